@@ -9,6 +9,9 @@ from typing import Dict, Any
 import subprocess
 import sys
 
+# Compact encoder reused for every request written to the server's stdin
+_ENCODER = json.JSONEncoder(separators=(",", ":"))
+
 class MCPClient:
     """Simple MCP client to communicate with the Telegram bridge"""
     
@@ -47,7 +50,7 @@ class MCPClient:
         if not self.process:
             raise RuntimeError("MCP server not started")
             
-        request_json = json.dumps(request) + "\n"
+        request_json = _ENCODER.encode(request) + "\n"
         self.process.stdin.write(request_json.encode())
         await self.process.stdin.drain()
         
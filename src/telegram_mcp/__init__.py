@@ -1,8 +1,16 @@
 """Telegram MCP Server - Enable LLM-Human communication via Telegram."""
 
+from typing import Any
+
 __version__ = "0.1.0"
 __author__ = "Telegram MCP Contributors"
 
-from .server import TelegramMCPServer
+__all__ = ["TelegramMCPServer"]
+
 
-__all__ = ["TelegramMCPServer"]
\ No newline at end of file
+def __getattr__(name: str) -> Any:
+    # Defer the heavy server import until TelegramMCPServer is actually used
+    if name == "TelegramMCPServer":
+        from .server import TelegramMCPServer
+        return TelegramMCPServer
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
\ No newline at end of file
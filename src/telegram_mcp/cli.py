@@ -3,12 +3,11 @@
 
 import sys
 import argparse
-from .server import main as server_main
 
 
 def get_chat_id():
     """Run the get_chat_id utility."""
-    from .get_chat_id import main as chat_id_main
+    from .get_chat_id import get_chat_id as chat_id_main
     chat_id_main()
 
 
@@ -26,6 +25,8 @@ def main():
     args = parser.parse_args()
     
     if args.command == 'server':
+        # Imported lazily: the server pulls in FastMCP and python-telegram-bot
+        from .server import main as server_main
         server_main()
     elif args.command == 'get-chat-id':
         get_chat_id()
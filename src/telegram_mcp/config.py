@@ -2,92 +2,130 @@
 Configuration settings for Telegram MCP Server
 """
 import os
-from typing import Optional
+from collections.abc import Callable
+from dataclasses import dataclass, field
+from functools import cache
+from typing import Any, Optional
 from pathlib import Path
 from dotenv import load_dotenv
 
 # Load environment variables from .env file
 load_dotenv()
 
+# Directory holding data, logs and config, resolved once as a plain string;
+# defaults to the directory containing the package
+_BASE_DIR = os.getenv('TELEGRAM_MCP_BASE_DIR') or os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def _env(name: str, default: str, cast: Callable[[str], Any] = str) -> Any:
+    """Build a dataclass field reading ``name`` from the environment, converted by ``cast``"""
+    return field(default_factory=lambda: cast(os.getenv(name, default)))
+
+
+@dataclass(frozen=True, slots=True)
 class Settings:
     """Central configuration for the Telegram MCP Server"""
     
     # Telegram Configuration
-    TELEGRAM_BOT_TOKEN: str = os.getenv('TELEGRAM_BOT_TOKEN', '')
-    TELEGRAM_CHAT_ID: str = os.getenv('TELEGRAM_CHAT_ID', '')
+    TELEGRAM_BOT_TOKEN: str = _env('TELEGRAM_BOT_TOKEN', '')
+    TELEGRAM_CHAT_ID: str = _env('TELEGRAM_CHAT_ID', '')
     
     # Server Configuration
-    LOG_LEVEL: str = os.getenv('LOG_LEVEL', 'INFO')
+    LOG_LEVEL: str = _env('LOG_LEVEL', 'INFO')
     
     # Timeout Configuration
-    DEFAULT_RESPONSE_TIMEOUT: int = int(os.getenv('DEFAULT_RESPONSE_TIMEOUT', '300'))
+    DEFAULT_RESPONSE_TIMEOUT: int = _env('DEFAULT_RESPONSE_TIMEOUT', '300', int)
+    
+    # History Configuration
+    MAX_HISTORY_SIZE: int = _env('MAX_HISTORY_SIZE', '1000', int)
     
     # Directory Configuration
-    BASE_DIR: Path = Path(__file__).parent.parent
-    DATA_DIR: Path = BASE_DIR / 'data'
-    LOGS_DIR: Path = BASE_DIR / 'logs'
-    CONFIG_DIR: Path = BASE_DIR / 'config'
+    BASE_DIR: Path = Path(_BASE_DIR)
+    DATA_DIR: Path = Path(_BASE_DIR, 'data')
+    LOGS_DIR: Path = Path(_BASE_DIR, 'logs')
+    CONFIG_DIR: Path = Path(_BASE_DIR, 'config')
+    LOG_FILE_PATH: Path = Path(_BASE_DIR, 'logs', 'telegram_mcp.log')
     
     # MCP Configuration
-    MCP_SERVER_NAME: str = os.getenv('MCP_SERVER_NAME', 'Telegram Bridge')
+    MCP_SERVER_NAME: str = _env('MCP_SERVER_NAME', 'Telegram Bridge')
     
     # Optional Features
-    ENABLE_HEALTH_CHECK: bool = os.getenv('ENABLE_HEALTH_CHECK', 'true').lower() == 'true'
-    HEALTH_CHECK_PORT: int = int(os.getenv('HEALTH_CHECK_PORT', '8080'))
+    ENABLE_HEALTH_CHECK: bool = _env(
+        'ENABLE_HEALTH_CHECK', 'true', lambda value: value.lower() == 'true'
+    )
+    HEALTH_CHECK_PORT: int = _env('HEALTH_CHECK_PORT', '8080', int)
     
-    @classmethod
-    def validate(cls) -> tuple[bool, list[str]]:
+    def validate(self) -> tuple[bool, list[str]]:
         """
         Validate required settings
         Returns: (is_valid, list_of_errors)
         """
         errors = []
         
-        if not cls.TELEGRAM_BOT_TOKEN:
+        if not self.TELEGRAM_BOT_TOKEN:
             errors.append("TELEGRAM_BOT_TOKEN is required")
         
-        if not cls.TELEGRAM_CHAT_ID:
+        if not self.TELEGRAM_CHAT_ID:
             errors.append("TELEGRAM_CHAT_ID is required")
         
         try:
-            int(cls.TELEGRAM_CHAT_ID)
+            int(self.TELEGRAM_CHAT_ID)
         except ValueError:
             errors.append("TELEGRAM_CHAT_ID must be a valid integer")
         
         # Validate log level
         valid_log_levels = ['DEBUG', 'INFO', 'WARNING', 'ERROR', 'CRITICAL']
-        if cls.LOG_LEVEL.upper() not in valid_log_levels:
+        if self.LOG_LEVEL.upper() not in valid_log_levels:
             errors.append(f"LOG_LEVEL must be one of: {', '.join(valid_log_levels)}")
         
+        if self.MAX_HISTORY_SIZE < 1:
+            errors.append("MAX_HISTORY_SIZE must be a positive integer")
+        
         return len(errors) == 0, errors
     
-    @classmethod
-    def create_directories(cls):
+    def create_directories(self):
         """Create necessary directories if they don't exist"""
-        for directory in [cls.DATA_DIR, cls.LOGS_DIR, cls.CONFIG_DIR]:
+        for directory in [self.DATA_DIR, self.LOGS_DIR, self.CONFIG_DIR]:
             directory.mkdir(parents=True, exist_ok=True)
     
-    @classmethod
-    def get_log_file_path(cls) -> Path:
+    def get_log_file_path(self) -> Path:
         """Get the path for the log file"""
-        return cls.LOGS_DIR / 'telegram_mcp.log'
+        return self.LOG_FILE_PATH
     
-    @classmethod
-    def to_dict(cls) -> dict:
+    def to_dict(self) -> dict:
         """Convert settings to dictionary (hiding sensitive values)"""
         return {
-            'TELEGRAM_BOT_TOKEN': '***' if cls.TELEGRAM_BOT_TOKEN else 'NOT SET',
-            'TELEGRAM_CHAT_ID': cls.TELEGRAM_CHAT_ID if cls.TELEGRAM_CHAT_ID else 'NOT SET',
-            'LOG_LEVEL': cls.LOG_LEVEL,
-            'DEFAULT_RESPONSE_TIMEOUT': cls.DEFAULT_RESPONSE_TIMEOUT,
-            'MCP_SERVER_NAME': cls.MCP_SERVER_NAME,
-            'ENABLE_HEALTH_CHECK': cls.ENABLE_HEALTH_CHECK,
-            'HEALTH_CHECK_PORT': cls.HEALTH_CHECK_PORT,
-            'BASE_DIR': str(cls.BASE_DIR),
-            'DATA_DIR': str(cls.DATA_DIR),
-            'LOGS_DIR': str(cls.LOGS_DIR),
-            'CONFIG_DIR': str(cls.CONFIG_DIR),
+            'TELEGRAM_BOT_TOKEN': '***' if self.TELEGRAM_BOT_TOKEN else 'NOT SET',
+            'TELEGRAM_CHAT_ID': self.TELEGRAM_CHAT_ID if self.TELEGRAM_CHAT_ID else 'NOT SET',
+            'LOG_LEVEL': self.LOG_LEVEL,
+            'DEFAULT_RESPONSE_TIMEOUT': self.DEFAULT_RESPONSE_TIMEOUT,
+            'MAX_HISTORY_SIZE': self.MAX_HISTORY_SIZE,
+            'MCP_SERVER_NAME': self.MCP_SERVER_NAME,
+            'ENABLE_HEALTH_CHECK': self.ENABLE_HEALTH_CHECK,
+            'HEALTH_CHECK_PORT': self.HEALTH_CHECK_PORT,
+            'BASE_DIR': str(self.BASE_DIR),
+            'DATA_DIR': str(self.DATA_DIR),
+            'LOGS_DIR': str(self.LOGS_DIR),
+            'CONFIG_DIR': str(self.CONFIG_DIR),
         }
 
+@cache
+def get_settings() -> Settings:
+    """Return the process-wide settings, reading the environment only once"""
+    return Settings()
+
+
+def prepare_settings() -> list[str]:
+    """
+    Validate the process-wide settings and create their directories
+    Returns: list_of_errors (empty when the server can start)
+    """
+    current = get_settings()
+    is_valid, errors = current.validate()
+    if is_valid:
+        current.create_directories()
+    return errors
+
+
 # Create a singleton instance
-settings = Settings()
\ No newline at end of file
+settings = get_settings()
@@ -0,0 +1,25 @@
+"""Pytest configuration for the Telegram MCP Server tests."""
+
+import os
+import shutil
+import tempfile
+
+_base_dir = None
+
+
+def pytest_configure(config):
+    """Set up the test environment before the package reads its settings."""
+    global _base_dir
+    os.environ.setdefault('MCP_SERVER_NAME', 'telegram-mcp')
+    
+    # Point runtime directories at a temp dir
+    if 'TELEGRAM_MCP_BASE_DIR' not in os.environ:
+        _base_dir = tempfile.mkdtemp(prefix='telegram-mcp-test-')
+        os.environ['TELEGRAM_MCP_BASE_DIR'] = _base_dir
+
+
+def pytest_unconfigure(config):
+    """Remove the temp dir created for the test session."""
+    if _base_dir is not None:
+        os.environ.pop('TELEGRAM_MCP_BASE_DIR', None)
+        shutil.rmtree(_base_dir, ignore_errors=True)
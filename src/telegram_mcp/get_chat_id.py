@@ -4,12 +4,27 @@ Utility script to get your Telegram chat ID
 Run this after creating your bot and sending it a message
 """
 import os
-import requests
-from dotenv import load_dotenv
 
-load_dotenv()
+# Seconds to wait for the Telegram API before giving up
+REQUEST_TIMEOUT = 10
+
+# Shared requests.Session, created on first use so importing stays cheap
+_session = None
+
+
+def _get_session():
+    """Return the shared HTTP session, creating it on first call"""
+    global _session
+    if _session is None:
+        import requests
+        _session = requests.Session()
+    return _session
+
 
 def get_chat_id():
+    from dotenv import load_dotenv
+    load_dotenv()
+    
     token = os.getenv('TELEGRAM_BOT_TOKEN')
     if not token:
         print("Error: TELEGRAM_BOT_TOKEN not found in environment")
@@ -19,7 +34,7 @@ def get_chat_id():
     url = f"https://api.telegram.org/bot{token}/getUpdates"
     
     print("Getting updates from Telegram...")
-    response = requests.get(url)
+    response = _get_session().get(url, timeout=REQUEST_TIMEOUT)
     
     if response.status_code == 200:
         data = response.json()
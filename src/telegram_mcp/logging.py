@@ -4,12 +4,30 @@ Logging configuration for Telegram MCP Server
 import logging
 import logging.handlers
 import json
+from contextvars import ContextVar
 from datetime import datetime, timezone
 from pathlib import Path
-from typing import Any, Dict
+from typing import Any
 
 from .config import settings
 
+try:
+    import orjson
+except ImportError:  # orjson is an optional speedup (pip install telegram-mcp[fast])
+    orjson = None  # type: ignore[assignment]
+
+# Extra fields for the current task/thread, populated by LogContext
+_log_extra: ContextVar[dict[str, Any] | None] = ContextVar('log_extra', default=None)
+
+
+class ContextFilter(logging.Filter):
+    """Attach the fields of the active LogContext to every record"""
+    
+    def filter(self, record: logging.LogRecord) -> bool:
+        # Fields passed via extra={'extra_fields': ...} win over the context
+        record.extra_fields = {**(_log_extra.get() or {}), **getattr(record, 'extra_fields', {})}
+        return True
+
 
 class JSONFormatter(logging.Formatter):
     """Custom JSON formatter for structured logging"""
@@ -17,7 +35,7 @@ class JSONFormatter(logging.Formatter):
     def format(self, record: logging.LogRecord) -> str:
         """Format log record as JSON"""
         log_data = {
-            'timestamp': datetime.now(timezone.utc).isoformat(),
+            'timestamp': datetime.fromtimestamp(record.created, timezone.utc).isoformat(),
             'level': record.levelname,
             'logger': record.name,
             'message': record.getMessage(),
@@ -31,9 +49,12 @@ class JSONFormatter(logging.Formatter):
             log_data['exception'] = self.formatException(record.exc_info)
         
         # Add extra fields if present
-        if hasattr(record, 'extra_fields'):
-            log_data.update(record.extra_fields)
+        extra_fields = getattr(record, 'extra_fields', None)
+        if extra_fields:
+            log_data.update(extra_fields)
         
+        if orjson is not None:
+            return orjson.dumps(log_data).decode()
         return json.dumps(log_data)
 
 
@@ -46,13 +67,14 @@ def setup_logging(log_level: str = None) -> None:
     """
     # Use provided log level or fall back to settings
     level = log_level or settings.LOG_LEVEL
+    level_int = logging.getLevelNamesMapping()[level.upper()]
     
     # Create logs directory if it doesn't exist
     settings.LOGS_DIR.mkdir(parents=True, exist_ok=True)
     
     # Configure root logger
     root_logger = logging.getLogger()
-    root_logger.setLevel(getattr(logging, level.upper()))
+    root_logger.setLevel(level_int)
     
     # Remove existing handlers
     for handler in root_logger.handlers[:]:
@@ -65,16 +87,18 @@ def setup_logging(log_level: str = None) -> None:
         datefmt='%Y-%m-%d %H:%M:%S'
     )
     console_handler.setFormatter(console_format)
-    console_handler.setLevel(getattr(logging, level.upper()))
+    console_handler.setLevel(level_int)
     root_logger.addHandler(console_handler)
     
     # File handler with JSON format
     file_handler = logging.handlers.RotatingFileHandler(
         settings.get_log_file_path(),
         maxBytes=10 * 1024 * 1024,  # 10MB
-        backupCount=5
+        backupCount=5,
+        encoding='utf-8'  # orjson writes raw UTF-8, e.g. emoji in human messages
     )
     file_handler.setFormatter(JSONFormatter())
+    file_handler.addFilter(ContextFilter())  # Inject LogContext fields
     file_handler.setLevel(logging.DEBUG)  # Always log DEBUG to file
     root_logger.addHandler(file_handler)
     
@@ -103,18 +127,11 @@ class LogContext:
     def __init__(self, logger: logging.Logger, **kwargs):
         self.logger = logger
         self.extra_fields = kwargs
-        self._original_factory = None
+        self._token = None
     
     def __enter__(self):
-        self._original_factory = logging.getLogRecordFactory()
-        
-        def record_factory(*args, **kwargs):
-            record = self._original_factory(*args, **kwargs)
-            record.extra_fields = self.extra_fields
-            return record
-        
-        logging.setLogRecordFactory(record_factory)
+        self._token = _log_extra.set({**(_log_extra.get() or {}), **self.extra_fields})
         return self
     
     def __exit__(self, exc_type, exc_val, exc_tb):
-        logging.setLogRecordFactory(self._original_factory)
\ No newline at end of file
+        _log_extra.reset(self._token)
\ No newline at end of file
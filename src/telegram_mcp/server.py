@@ -5,19 +5,24 @@ Telegram MCP Server - Bidirectional communication between LLM and Telegram
 import asyncio
 from contextlib import asynccontextmanager
 from datetime import datetime
+import hashlib
+import json
 import sys
-from collections import deque
+import time
+from typing import NamedTuple
+from collections import OrderedDict, deque
+from itertools import islice
 import signal
 
 # Configuration and logging
-from .config import settings
+from .config import settings, prepare_settings
 from .logging import setup_logging, get_logger
 
 # FastMCP and MCP imports
 from fastmcp import FastMCP
 
 # Telegram imports
-from telegram import Update, Bot
+from telegram import Update, Bot, ForceReply
 from telegram.ext import Application, MessageHandler, filters, ContextTypes
 
 # Set up logging
@@ -31,7 +36,29 @@ class Constants:
     DEFAULT_TIMEOUT = 300  # Default response timeout in seconds
     MAX_HISTORY_SIZE = 1000  # Maximum conversation history size
     MAX_MESSAGE_PREVIEW = 50  # Characters to show in log previews
-    BOT_STARTUP_DELAY = 1  # Seconds to wait for bot initialization
+    DEFAULT_CACHE_TTL = 300  # Seconds a cached tool result stays valid
+    TOOL_CACHE_SIZE = 256  # Maximum number of cached tool results
+    ACK_RESPONSE_RECEIVED = "✅ Response received and forwarded to LLM"
+    ACK_MESSAGE_NOTED = "📝 Message noted. Waiting for LLM to request next interaction."
+
+
+class HistoryEntry(NamedTuple):
+    """A single message in the conversation history"""
+    timestamp: datetime
+    type: str  # 'llm_to_human' or 'human_to_llm'
+    message: str
+    message_id: int | None
+    in_reply_to: int | None = None  # Prompt message_id a human reply answered
+
+
+# Reply markup attached to prompts that wait for an answer
+_FORCE_REPLY = ForceReply(selective=True)
+
+# Special characters of Telegram's MarkdownV2
+_MARKDOWN_SPECIALS = frozenset('_*[]()~`>#+-=|{}.!')
+
+# Translation table escaping every special character
+_MARKDOWN_ESCAPES = str.maketrans({char: f'\\{char}' for char in _MARKDOWN_SPECIALS})
 
 
 def escape_markdown(text: str) -> str:
@@ -44,22 +71,21 @@ def escape_markdown(text: str) -> str:
     Returns:
         Escaped text safe for Telegram markdown
     """
-    # List of special characters in Telegram's MarkdownV2
-    special_chars = ['_', '*', '[', ']', '(', ')', '~', '`', '>', '#', '+', '-', '=', '|', '{', '}', '.', '!']
-    
-    # Escape each special character
-    for char in special_chars:
-        text = text.replace(char, f'\\{char}')
-    
-    return text
+    # Escape every special character in a single pass
+    return text.translate(_MARKDOWN_ESCAPES)
 
 class TelegramMCPServer:
     def __init__(self, bot_token: str, authorized_chat_id: int, max_history_size: int = Constants.MAX_HISTORY_SIZE):
         self.bot_token = bot_token
         self.authorized_chat_id = authorized_chat_id
-        self.bot = Bot(token=bot_token)
-        self.pending_responses = {}  # Store pending human responses
-        self.conversation_history = deque(maxlen=max_history_size)  # Bounded conversation history
+        self.bot: Bot | None = None  # Shared with telegram_app once the bot is started
+        self.pending_responses: dict[int, asyncio.Future] = {}  # Keyed by message_id, oldest first
+        self.conversation_history: deque[HistoryEntry] = deque(maxlen=max_history_size)  # Bounded conversation history
+        
+        # Opt-in LRU cache of send_message_to_human results: key -> (stored_at, result)
+        self._tool_cache: OrderedDict[str, tuple[float, dict]] = OrderedDict()
+        self.cache_hits = 0
+        self.cache_misses = 0
         
         # Initialize FastMCP
         self.mcp = FastMCP(settings.MCP_SERVER_NAME or "telegram-mcp")
@@ -75,7 +101,7 @@ class TelegramMCPServer:
         """Setup MCP tools for LLM interaction"""
         
         @self.mcp.tool()
-        async def send_message_to_human(message: str, wait_for_response: bool = True, timeout_seconds: int = Constants.DEFAULT_TIMEOUT, escape_markdown_chars: bool = True) -> dict:
+        async def send_message_to_human(message: str, wait_for_response: bool = True, timeout_seconds: float = Constants.DEFAULT_TIMEOUT, escape_markdown_chars: bool = True, cacheable: bool = False, cache_ttl: int = Constants.DEFAULT_CACHE_TTL) -> dict:
             """
             Send a message to the human via Telegram and optionally wait for a response.
             
@@ -84,64 +110,30 @@ class TelegramMCPServer:
                 wait_for_response: Whether to wait for a human response
                 timeout_seconds: How long to wait for a response (default 300 seconds)
                 escape_markdown_chars: Whether to escape markdown special characters (default True)
+                cacheable: Reuse the result of an identical earlier call instead of sending again (default False)
+                cache_ttl: How long a cached result stays valid in seconds (default 300 seconds)
             
             Returns:
-                dict: Contains 'sent' status and 'response' if wait_for_response=True
+                dict: Contains 'sent' status and 'response' if wait_for_response=True,
+                plus 'cache_hit' when the result was served from the cache
             """
-            try:
-                # Escape markdown if requested (recommended for user-generated content)
-                safe_message = escape_markdown(message) if escape_markdown_chars else message
-                
-                # Send message to Telegram
-                sent_message = await self.bot.send_message(
-                    chat_id=self.authorized_chat_id,
-                    text=safe_message,
-                    parse_mode='Markdown'
-                )
-                
-                # Add to conversation history
-                self.conversation_history.append({
-                    'timestamp': datetime.now().isoformat(),
-                    'type': 'llm_to_human',
-                    'message': message,
-                    'message_id': sent_message.message_id
-                })
-                
-                logger.info(f"Sent message to human: {message[:Constants.MAX_MESSAGE_PREVIEW]}...")
-                
-                if not wait_for_response:
-                    return {
-                        'sent': True,
-                        'message_id': sent_message.message_id,
-                        'timestamp': datetime.now().isoformat()
-                    }
-                
-                # Wait for human response using proper async pattern
-                response_id = f"response_{sent_message.message_id}"
-                try:
-                    response = await self._wait_for_response(response_id, timeout_seconds)
-                    return {
-                        'sent': True,
-                        'response': response,
-                        'message_id': sent_message.message_id,
-                        'timestamp': datetime.now().isoformat()
-                    }
-                except asyncio.TimeoutError:
-                    return {
-                        'sent': True,
-                        'response': None,
-                        'error': 'Response timeout',
-                        'message_id': sent_message.message_id,
-                        'timestamp': datetime.now().isoformat()
-                    }
-                
-            except Exception as e:
-                logger.error(f"Error sending message: {e}")
-                return {
-                    'sent': False,
-                    'error': str(e),
-                    'timestamp': datetime.now().isoformat()
-                }
+            cache_key = None
+            if cacheable:
+                cache_key = self._tool_cache_key(message, wait_for_response, escape_markdown_chars)
+                cached = self._get_cached_result(cache_key, cache_ttl)
+                if cached is not None:
+                    return cached
+            
+            result = await self._send_message(message, wait_for_response, timeout_seconds, escape_markdown_chars)
+            
+            # Only cache successful exchanges; errors, timeouts and prompts released
+            # without a reply at shutdown must be retried
+            if (
+                cache_key is not None and result['sent'] and 'error' not in result
+                and (not wait_for_response or result['response'] is not None)
+            ):
+                self._cache_result(cache_key, result)
+            return result
         
         @self.mcp.tool()
         async def get_conversation_history(limit: int = 10) -> dict:
@@ -154,13 +146,16 @@ class TelegramMCPServer:
             Returns:
                 dict: Contains conversation history
             """
-            # Convert deque to list for the response
-            history_list = list(self.conversation_history)
-            recent_history = history_list[-limit:] if limit > 0 else history_list
+            # Walk back from the newest entry so only `limit` items are touched
+            if limit > 0:
+                recent_history = [entry._asdict() for entry in islice(reversed(self.conversation_history), limit)]
+                recent_history.reverse()
+            else:
+                recent_history = [entry._asdict() for entry in self.conversation_history]
             return {
                 'history': recent_history,
                 'total_messages': len(self.conversation_history),
-                'timestamp': datetime.now().isoformat()
+                'timestamp': datetime.now()
             }
         
         @self.mcp.tool()
@@ -174,15 +169,107 @@ class TelegramMCPServer:
             self.conversation_history.clear()
             return {
                 'cleared': True,
-                'timestamp': datetime.now().isoformat()
+                'timestamp': datetime.now()
+            }
+
+    async def _send_message(self, message: str, wait_for_response: bool, timeout_seconds: float, escape_markdown_chars: bool) -> dict:
+        """Send a message to Telegram and optionally wait for the human's reply"""
+        try:
+            # Escape markdown if requested (recommended for user-generated content)
+            safe_message = escape_markdown(message) if escape_markdown_chars else message
+            
+            # Send message to Telegram; a prompt asks the client to open a reply
+            # to it so the answer is threaded
+            reply_markup = _FORCE_REPLY if wait_for_response else None
+            sent_message = await self._send_to_telegram(safe_message, reply_markup=reply_markup)
+            
+            # Add to conversation history
+            sent_at = datetime.now()
+            self.conversation_history.append(
+                HistoryEntry(sent_at, 'llm_to_human', message, sent_message.message_id)
+            )
+            
+            logger.info("Sent message to human: %.*s...", Constants.MAX_MESSAGE_PREVIEW, message)
+            
+            if not wait_for_response:
+                return {
+                    'sent': True,
+                    'message_id': sent_message.message_id,
+                    'timestamp': sent_at
+                }
+            
+            # Wait for human response using proper async pattern
+            try:
+                response = await self._wait_for_response(sent_message.message_id, timeout_seconds)
+                return {
+                    'sent': True,
+                    'response': response,
+                    'message_id': sent_message.message_id,
+                    'timestamp': datetime.now()
+                }
+            except asyncio.TimeoutError:
+                return {
+                    'sent': True,
+                    'response': None,
+                    'error': 'Response timeout',
+                    'message_id': sent_message.message_id,
+                    'timestamp': datetime.now()
+                }
+        
+        except Exception as e:
+            logger.error("Error sending message: %s", e)
+            return {
+                'sent': False,
+                'error': str(e),
+                'timestamp': datetime.now()
             }
 
-    async def _wait_for_response(self, response_id: str, timeout_seconds: int) -> str:
+    async def _send_to_telegram(self, text: str, reply_markup: ForceReply | None = None):
+        """Send a single message to the authorized chat"""
+        if self.bot is None:
+            raise RuntimeError("Telegram bot not started")
+        
+        # Plain text has nothing for Telegram to parse, so skip Markdown entirely
+        parse_mode = None if _MARKDOWN_SPECIALS.isdisjoint(text) else 'Markdown'
+        return await self.bot.send_message(
+            chat_id=self.authorized_chat_id,
+            text=text,
+            parse_mode=parse_mode,
+            reply_markup=reply_markup
+        )
+
+    def _tool_cache_key(self, message: str, wait_for_response: bool, escape_markdown_chars: bool) -> str:
+        """Build the cache key identifying an idempotent send_message_to_human call"""
+        payload = json.dumps({'m': message, 'w': wait_for_response, 'e': escape_markdown_chars}, sort_keys=True)
+        return hashlib.sha256(payload.encode()).hexdigest()
+
+    def _get_cached_result(self, cache_key: str, cache_ttl: int) -> dict | None:
+        """Return a fresh cached result for the key, or None on a miss"""
+        entry = self._tool_cache.get(cache_key)
+        if entry is not None:
+            stored_at, result = entry
+            if time.monotonic() - stored_at < cache_ttl:
+                self._tool_cache.move_to_end(cache_key)
+                self.cache_hits += 1
+                return {**result, 'cache_hit': True}
+            # Expired entries are dropped on access
+            del self._tool_cache[cache_key]
+        self.cache_misses += 1
+        return None
+
+    def _cache_result(self, cache_key: str, result: dict):
+        """Store a result, evicting the least recently used entry when full"""
+        self._tool_cache[cache_key] = (time.monotonic(), result)
+        self._tool_cache.move_to_end(cache_key)
+        if len(self._tool_cache) > Constants.TOOL_CACHE_SIZE:
+            self._tool_cache.popitem(last=False)
+
+    async def _wait_for_response(self, message_id: int, timeout_seconds: float) -> str:
         """
         Wait for a response with proper async handling and cleanup.
         
         Args:
-            response_id: Unique ID for the response
+            message_id: ID of the Telegram message awaiting a reply
             timeout_seconds: Maximum time to wait
             
         Returns:
@@ -191,76 +278,84 @@ class TelegramMCPServer:
         Raises:
             asyncio.TimeoutError: If timeout occurs
         """
-        event = asyncio.Event()
-        self.pending_responses[response_id] = {
-            'waiting': True,
-            'response': None,
-            'timestamp': datetime.now().isoformat(),
-            'event': event
-        }
+        future = asyncio.get_running_loop().create_future()
+        self.pending_responses[message_id] = future
         
         try:
-            # Wait for the event with timeout
-            await asyncio.wait_for(event.wait(), timeout=timeout_seconds)
-            return self.pending_responses[response_id]['response']
+            # Wait for the handler to resolve the future, with timeout
+            async with asyncio.timeout(timeout_seconds):
+                return await future
         finally:
             # Always cleanup the pending response
-            self.pending_responses.pop(response_id, None)
+            self.pending_responses.pop(message_id, None)
 
     async def handle_telegram_message(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
         """Handle incoming Telegram messages"""
         
-        # Security check - only respond to authorized user
-        if update.effective_chat.id != self.authorized_chat_id:
-            logger.warning(f"Unauthorized access attempt from chat_id: {update.effective_chat.id}")
-            await update.message.reply_text("❌ Unauthorized access")
+        # Security check - the handler filter already drops other chats,
+        # so this is only a defensive guard and never replies
+        chat_id = update.effective_chat.id
+        if chat_id != self.authorized_chat_id:
+            logger.warning("Unauthorized access attempt from chat_id: %s", chat_id)
             return
         
         message_text = update.message.text
         message_id = update.message.message_id
         
-        logger.info(f"Received message from human: {message_text[:Constants.MAX_MESSAGE_PREVIEW]}...")
+        logger.info("Received message from human: %.*s...", Constants.MAX_MESSAGE_PREVIEW, message_text)
         
-        # Add to conversation history
-        self.conversation_history.append({
-            'timestamp': datetime.now().isoformat(),
-            'type': 'human_to_llm',
-            'message': message_text,
-            'message_id': message_id
-        })
+        # Check if this is a response to a pending request: a reply resolves only
+        # the prompt it answers, a plain message fulfills the most recent one
+        prompt_id = None
+        reply_to = update.message.reply_to_message
+        if reply_to is not None:
+            prompt_id = reply_to.message_id
+        elif self.pending_responses:
+            # Get the most recent pending response (dicts keep insertion order)
+            prompt_id = next(reversed(self.pending_responses))
         
-        # Check if this is a response to a pending request
-        # Look for any pending responses and fulfill the most recent one
-        if self.pending_responses:
-            # Get the most recent pending response
-            latest_key = max(self.pending_responses.keys(), 
-                           key=lambda x: self.pending_responses[x]['timestamp'])
+        future = None
+        if prompt_id is not None:
+            future = self.pending_responses.get(prompt_id)
+            if future is not None and future.done():
+                future = None
+        
+        # Add to conversation history, linked to the prompt it answers
+        self.conversation_history.append(
+            HistoryEntry(
+                datetime.now(), 'human_to_llm', message_text, message_id,
+                prompt_id if future is not None else None
+            )
+        )
+        
+        if future is not None:
+            # Resolve the future to wake up the waiting coroutine
+            future.set_result(message_text)
             
-            if self.pending_responses[latest_key]['waiting']:
-                self.pending_responses[latest_key]['response'] = message_text
-                self.pending_responses[latest_key]['waiting'] = False
-                
-                # Trigger the event to wake up the waiting coroutine
-                if 'event' in self.pending_responses[latest_key]:
-                    self.pending_responses[latest_key]['event'].set()
-                
-                # Send confirmation
-                await update.message.reply_text("✅ Response received and forwarded to LLM")
-                return
+            # Send confirmation
+            await update.message.reply_text(Constants.ACK_RESPONSE_RECEIVED, disable_notification=True)
+            return
         
         # If no pending response, this is an unsolicited message
         # You could implement additional logic here, like storing unsolicited messages
         # or sending them to the LLM proactively
-        await update.message.reply_text("📝 Message noted. Waiting for LLM to request next interaction.")
+        logger.info("Unsolicited message %s (reply to: %s)", message_id, prompt_id)
+        await update.message.reply_text(Constants.ACK_MESSAGE_NOTED, disable_notification=True)
 
     async def start_telegram_bot(self):
         """Start the Telegram bot"""
         try:
             self.telegram_app = Application.builder().token(self.bot_token).build()
             
-            # Add message handler
+            # Reuse the application's Bot so sends share its connection pool
+            self.bot = self.telegram_app.bot
+            
+            # Add message handler; updates from other chats are dropped before dispatch
             self.telegram_app.add_handler(
-                MessageHandler(filters.TEXT & ~filters.COMMAND, self.handle_telegram_message)
+                MessageHandler(
+                    filters.Chat(chat_id=self.authorized_chat_id) & filters.TEXT & ~filters.COMMAND,
+                    self.handle_telegram_message
+                )
             )
             
             # Start the bot
@@ -271,7 +366,7 @@ class TelegramMCPServer:
             logger.info("Telegram bot started successfully")
             
         except Exception as e:
-            logger.error(f"Error starting Telegram bot: {e}")
+            logger.error("Error starting Telegram bot: %s", e)
             raise
 
     async def stop_telegram_bot(self):
@@ -286,10 +381,10 @@ class TelegramMCPServer:
         logger.info("Initiating graceful shutdown...")
         self._shutdown_event.set()
         
-        # Cancel all pending responses
-        for response_id, response_data in list(self.pending_responses.items()):
-            if 'event' in response_data:
-                response_data['event'].set()
+        # Release all pending responses without a reply
+        for future in list(self.pending_responses.values()):
+            if not future.done():
+                future.set_result(None)
         
         # Stop the Telegram bot
         await self.stop_telegram_bot()
@@ -313,31 +408,29 @@ class TelegramMCPServer:
 async def async_main():
     """Async main function to run both Telegram bot and MCP server"""
     
-    # Validate configuration
-    is_valid, errors = settings.validate()
-    if not is_valid:
+    # Validate configuration and create directories
+    errors = prepare_settings()
+    if errors:
         logger.error("Configuration validation failed:")
         for error in errors:
-            logger.error(f"  - {error}")
+            logger.error("  - %s", error)
         sys.exit(1)
     
-    # Create directories
-    settings.create_directories()
-    
     # Log startup info
     logger.info("Starting Telegram MCP Server")
-    logger.info(f"Server name: {settings.MCP_SERVER_NAME}")
-    logger.info(f"Log level: {settings.LOG_LEVEL}")
-    logger.info(f"Chat ID: {settings.TELEGRAM_CHAT_ID}")
+    logger.info("Server name: %s", settings.MCP_SERVER_NAME)
+    logger.info("Log level: %s", settings.LOG_LEVEL)
+    logger.info("Chat ID: %s", settings.TELEGRAM_CHAT_ID)
     
     # Create server instance
     server = TelegramMCPServer(
         settings.TELEGRAM_BOT_TOKEN, 
-        int(settings.TELEGRAM_CHAT_ID)
+        int(settings.TELEGRAM_CHAT_ID),
+        max_history_size=settings.MAX_HISTORY_SIZE
     )
     
     # Set up signal handlers for graceful shutdown
-    loop = asyncio.get_event_loop()
+    loop = asyncio.get_running_loop()
     
     def signal_handler():
         asyncio.create_task(server.shutdown_handler())
@@ -345,48 +438,37 @@ async def async_main():
     for sig in (signal.SIGTERM, signal.SIGINT):
         loop.add_signal_handler(sig, signal_handler)
     
-    # Start Telegram bot in background task
-    telegram_task = None
     try:
-        # Start the Telegram bot as a background task
-        telegram_task = asyncio.create_task(server.start_telegram_bot())
-        
-        # Give the bot a moment to initialize
-        await asyncio.sleep(Constants.BOT_STARTUP_DELAY)
-        
-        # Check if telegram bot started successfully
-        if telegram_task.done() and telegram_task.exception():
-            raise telegram_task.exception()
+        # Start the Telegram bot; returns once polling is running
+        await server.start_telegram_bot()
         
         logger.info("Telegram bot started, running MCP server...")
         
-        # Run the MCP server (this will handle stdio)
-        # Note: FastMCP's run() method needs to be called from sync context
-        # So we'll use run_in_executor to bridge the gap
-        await loop.run_in_executor(None, server.mcp.run, "stdio")
+        # Serve MCP over stdio on the same event loop as the Telegram bot
+        await server.mcp.run_async("stdio")
         
     except Exception as e:
-        logger.error(f"Server error: {e}")
+        logger.error("Server error: %s", e)
         raise
     finally:
         # Cleanup
-        if telegram_task and not telegram_task.done():
-            telegram_task.cancel()
-            try:
-                await telegram_task
-            except asyncio.CancelledError:
-                pass
         await server.stop_telegram_bot()
 
-
 def main():
     """Main entry point - sets up async event loop"""
     try:
-        asyncio.run(async_main())
+        # Prefer the libuv-based event loop when the optional uvloop is installed
+        import uvloop
+        run = uvloop.run
+    except ImportError:
+        run = asyncio.run
+    
+    try:
+        run(async_main())
     except KeyboardInterrupt:
         logger.info("Received interrupt signal, shutting down...")
     except Exception as e:
-        logger.error(f"Fatal error: {e}")
+        logger.error("Fatal error: %s", e)
         sys.exit(1)
 
 if __name__ == "__main__":